@@ -5,31 +5,47 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, TEXT
+from pymongo.errors import ConfigurationError, ConnectionFailure, PyMongoError
 from datetime import datetime, timezone
+import logging
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import List, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 _client = None
 db = None
 
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
+# One pooled client per process. Each uvicorn worker gets its own pool, so
+# split a budget of 100 connections across WEB_CONCURRENCY workers by default.
+_workers = max(int(os.getenv("WEB_CONCURRENCY", 1)), 1)
+max_pool_size = int(os.getenv("MONGO_MAX_POOL_SIZE", max(100 // _workers, 1)))
+min_pool_size = min(int(os.getenv("MONGO_MIN_POOL_SIZE", 5)), max_pool_size)
+
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    _client = AsyncIOMotorClient(
+        database_url,
+        maxPoolSize=max_pool_size,
+        minPoolSize=min_pool_size,
+        serverSelectionTimeoutMS=2000,
+    )
     db = _client[database_name]
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+        raise ConfigurationError("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
 
     # Convert Pydantic model to dict if needed
     if isinstance(data, BaseModel):
@@ -40,16 +56,115 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
+async def create_documents(collection_name: str, data: List[Union[BaseModel, dict]]):
+    """Insert many documents with timestamps in a single round-trip"""
+    if db is None:
+        raise ConfigurationError("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+    if not data:
+        return []
+
+    now = datetime.now(timezone.utc)
+    docs = []
+    for item in data:
+        doc = item.model_dump() if isinstance(item, BaseModel) else item.copy()
+        doc['created_at'] = now
+        doc['updated_at'] = now
+        docs.append(doc)
+
+    # Unordered lets the server apply the writes in parallel
+    result = await db[collection_name].insert_many(docs, ordered=False)
+    return [str(_id) for _id in result.inserted_ids]
+
+async def get_document(collection_name: str, filter_dict: dict, projection: dict = None):
+    """Get a single document from collection, or None if it does not exist"""
     if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+        raise ConfigurationError("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    doc = await db[collection_name].find_one(filter_dict, projection)
+    if doc is not None and "_id" in doc:
+        doc["_id"] = str(doc["_id"])
+    return doc
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None,
+                        projection: dict = None, sort: list = None, collation: dict = None):
+    """Get documents from collection, optionally projected and sorted"""
+    if db is None:
+        raise ConfigurationError("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = db[collection_name].find(filter_dict or {}, projection, collation=collation)
+    if sort:
+        cursor = cursor.sort(sort)
     if limit:
-        cursor = cursor.limit(limit)
+        # Fetch exactly one batch of `limit` docs instead of the default 101
+        cursor = cursor.limit(limit).batch_size(limit)
     
-    return list(cursor)
+    docs = await cursor.to_list(length=limit)
+    # ObjectId is not JSON serializable; expose ids as strings
+    for doc in docs:
+        if "_id" in doc:
+            doc["_id"] = str(doc["_id"])
+    return docs
+
+def iter_documents(collection_name: str, filter_dict: dict = None, limit: int = None,
+                   projection: dict = None, sort: list = None, collation: dict = None):
+    """Async-iterate documents from collection without buffering the result set"""
+    if db is None:
+        raise ConfigurationError("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    cursor = db[collection_name].find(filter_dict or {}, projection, collation=collation)
+    if sort:
+        cursor = cursor.sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    return _with_str_ids(cursor)
+
+async def _with_str_ids(cursor):
+    try:
+        async for doc in cursor:
+            if "_id" in doc:
+                doc["_id"] = str(doc["_id"])
+            yield doc
+    finally:
+        # Callers may stop early; release the server-side cursor
+        await cursor.close()
+
+# Strength 2 compares case-insensitively; queries must pass the same
+# collation to use an index built with it
+CASE_INSENSITIVE = {"locale": "en", "strength": 2}
+
+# (collection, keys, options) for every index the API queries rely on
+_INDEXES = [
+    # Text index backing /api/products/search; title matches rank higher
+    ("product", [("title", TEXT), ("description", TEXT)],
+     {"weights": {"title": 10, "description": 3}, "name": "product_text"}),
+    # Equality on category with an optional tags $in, and tags on their own.
+    # A collection allows only one text index, so category cannot also be
+    # added as a prefix of product_text without requiring it on every search.
+    ("product", [("category", ASCENDING), ("tags", ASCENDING)], {}),
+    ("product", [("tags", ASCENDING)], {}),
+    # Case-insensitive title index; the title prefix fallback range-scans it
+    ("product", [("title", ASCENDING)], {"collation": CASE_INSENSITIVE, "name": "title_ci"}),
+    # Blog detail route looks posts up by slug
+    ("blogpost", [("slug", ASCENDING)], {}),
+]
+
+async def ensure_indexes():
+    """Create the indexes the API queries rely on (idempotent)
+
+    Failures are logged rather than raised so the app still boots when
+    Mongo is unreachable or an index conflicts with an existing one.
+    """
+    if db is None:
+        return
+    for collection_name, keys, options in _INDEXES:
+        try:
+            await db[collection_name].create_index(keys, **options)
+        except ConnectionFailure as e:
+            # Unreachable server: every remaining index would time out too
+            logger.warning("Skipping index creation, database unreachable: %s", e)
+            return
+        except PyMongoError as e:
+            logger.warning("Could not create index %s on %s: %s", keys, collection_name, e)
@@ -1,11 +1,56 @@
+import asyncio
+import inspect
+import logging
 import os
-from fastapi import FastAPI, HTTPException
+import secrets
+from contextlib import asynccontextmanager
+import orjson
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import Body, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
-from database import create_document, get_documents
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.coder import Coder
+from fastapi_cache.decorator import cache
+from pydantic import BaseModel, Field
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError, ConfigurationError, PyMongoError
+from typing import Annotated, List, Optional
+from database import CASE_INSENSITIVE, db, create_document, create_documents, get_document, get_documents, iter_documents, ensure_indexes
+import schemas
 
-app = FastAPI(title="AI Webshop API")
+logger = logging.getLogger(__name__)
+
+# schemas.py is static, so read its source once for /schema
+try:
+    _SCHEMA_SRC = inspect.getsource(schemas)
+except OSError:
+    _SCHEMA_SRC = ""
+
+class ORJSONCoder(Coder):
+    """Cache coder matching ORJSONResponse output, so hits render like misses"""
+
+    @classmethod
+    def encode(cls, value) -> bytes:
+        return orjson.dumps(value, default=str)
+
+    @classmethod
+    def decode(cls, value: bytes):
+        return orjson.loads(value)
+
+# Startup/shutdown in one place; the category refresh helpers live with
+# the catalog endpoints below
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ensure_indexes()
+    FastAPICache.init(InMemoryBackend(), coder=ORJSONCoder)
+    await start_categories_refresh()
+    yield
+    stop_categories_refresh()
+
+app = FastAPI(title="AI Webshop API", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,92 +60,254 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(PyMongoError)
+async def database_error_handler(request: Request, exc: PyMongoError):
+    return ORJSONResponse(status_code=500, content={"detail": str(exc)})
+
+# Content endpoints change rarely; cache their responses per worker
+CONTENT_CACHE_TTL = int(os.getenv("CONTENT_CACHE_TTL", 300))
+
 # Public health/root
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "AI Webshop Backend running"}
 
 # Schema exposure for the database viewer
 @app.get("/schema")
-def get_schema():
-    import inspect, schemas
-    models = {}
-    for name, obj in inspect.getmembers(schemas):
-        if inspect.isclass(obj) and issubclass(obj, schemas.BaseModel) is False:
-            # skip non pydantic items
-            pass
-    # Fast path: just return module source so viewer can parse
-    import pkgutil
-    import importlib
-    import json
-    try:
-        import schemas as s
-        source = pkgutil.get_loader(s.__name__).get_source(s.__name__)
-    except Exception:
-        source = ""
-    return {"source": source}
+async def get_schema():
+    return {"source": _SCHEMA_SRC}
 
 # --------- Catalog Endpoints ---------
+# Upper bound on products per buffered search; also the largest cursor batch
+# requested. ?stream=1 is exempt since it never holds the result set.
+SEARCH_MAX_LIMIT = 200
+
 class ProductFilter(BaseModel):
     category: Optional[str] = None
     q: Optional[str] = None
     tags: Optional[List[str]] = None
-    limit: int = 24
+    limit: int = Field(24, ge=1)
+
+# Fields the product listing renders; the full document is not needed
+PRODUCT_LIST_FIELDS = {"title": 1, "price": 1, "images": {"$slice": 1}, "category": 1, "in_stock": 1}
+_TITLE_SORT = [("title", ASCENDING)]
+# Sorts after every other character under ICU collation; caps the prefix range
+_PREFIX_END = "\uffff"
+
+# Categories back the site navigation and almost never change, so each
+# worker serves them from memory and re-polls Mongo in the background
+CATEGORIES_REFRESH_INTERVAL = int(os.getenv("CATEGORIES_REFRESH_INTERVAL", 60))
+# None until the first successful load, so an outage is not served as an
+# empty navigation
+_CATEGORIES_CACHE: Optional[list] = None
+# Serialises reloads so the poller and the refresh route don't race
+_categories_lock = asyncio.Lock()
+_categories_task = None
+
+async def _load_categories():
+    global _CATEGORIES_CACHE
+    async with _categories_lock:
+        _CATEGORIES_CACHE = await get_documents("category", {}, None)
+
+async def _refresh_categories():
+    while True:
+        await asyncio.sleep(CATEGORIES_REFRESH_INTERVAL)
+        try:
+            await _load_categories()
+        except PyMongoError as e:
+            # keep serving the last good list until Mongo is back
+            logger.warning("Could not refresh categories: %s", e)
+
+async def start_categories_refresh():
+    global _categories_task
+    if db is None:
+        return
+    try:
+        await _load_categories()
+    except PyMongoError as e:
+        logger.warning("Could not load categories at startup: %s", e)
+    _categories_task = asyncio.create_task(_refresh_categories())
+
+def stop_categories_refresh():
+    if _categories_task is not None:
+        _categories_task.cancel()
 
 @app.get("/api/categories")
-def list_categories():
+async def list_categories():
+    if _CATEGORIES_CACHE is None:
+        raise HTTPException(status_code=503, detail="Categories unavailable")
+    return {"categories": _CATEGORIES_CACHE}
+
+@app.post("/api/categories/refresh")
+async def refresh_categories(x_admin_token: Optional[str] = Header(None)):
+    """Reload categories from Mongo immediately.
+
+    Per-worker only: it refreshes the worker that serves the request, and
+    the others pick up changes on their next background poll. Requires the
+    ADMIN_TOKEN environment variable to be set and sent as X-Admin-Token.
+    """
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token or not x_admin_token or not secrets.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    await _load_categories()
+    return {"categories": _CATEGORIES_CACHE}
+
+async def _title_prefix_matches(payload: ProductFilter):
+    # $text only matches whole words; fall back to a title prefix match.
+    # A case-insensitive regex cannot range-scan an index, so express the
+    # prefix as a range under the title_ci index's collation. Only title is
+    # queried under that collation; category/tags keep their exact-match
+    # semantics by being checked here as the title-ordered rows stream in.
+    projection = {**PRODUCT_LIST_FIELDS, "tags": 1} if payload.tags else PRODUCT_LIST_FIELDS
+    docs = iter_documents("product", {"title": {"$gte": payload.q, "$lt": payload.q + _PREFIX_END}},
+                          projection=projection, sort=_TITLE_SORT, collation=CASE_INSENSITIVE)
+    found = 0
     try:
-        cats = get_documents("category", {}, None)
-        return {"categories": cats}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        async for doc in docs:
+            if payload.category and doc.get("category") != payload.category:
+                continue
+            if payload.tags:
+                tags = doc.pop("tags", None)
+                tags = tags if isinstance(tags, list) else [tags]
+                if not any(t in tags for t in payload.tags):
+                    continue
+            yield doc
+            found += 1
+            if found >= payload.limit:
+                break
+    finally:
+        await docs.aclose()
+
+async def _open_product_stream(filt: dict, projection: dict, sort: Optional[list], payload: ProductFilter):
+    # Run the query (and the fallback decision) before any response is
+    # started, so database errors still reach the PyMongoError handler
+    docs = iter_documents("product", filt, payload.limit, projection=projection, sort=sort)
+    first = await _first_or_none(docs)
+    if first is None and payload.q:
+        docs = _title_prefix_matches(payload)
+        first = await _first_or_none(docs)
+    return first, docs
+
+async def _first_or_none(docs):
+    try:
+        return await docs.__anext__()
+    except StopAsyncIteration:
+        return None
+
+async def _ndjson(first, docs):
+    if first is None:
+        return
+    yield orjson.dumps(first) + b"\n"
+    async for doc in docs:
+        yield orjson.dumps(doc) + b"\n"
 
 @app.post("/api/products/search")
-def search_products(payload: ProductFilter):
-    from pymongo import ASCENDING
+async def search_products(payload: ProductFilter, stream: bool = False):
     filt = {}
     if payload.category:
         filt["category"] = payload.category
-    if payload.q:
-        filt["$or"] = [
-            {"title": {"$regex": payload.q, "$options": "i"}},
-            {"description": {"$regex": payload.q, "$options": "i"}},
-        ]
     if payload.tags:
         filt["tags"] = {"$in": payload.tags}
-    try:
-        docs = get_documents("product", filt, payload.limit)
-        return {"products": docs}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    sort = None
+    if payload.q:
+        # Uses the product_text index instead of scanning with $regex
+        filt["$text"] = {"$search": payload.q}
+        projection = {**PRODUCT_LIST_FIELDS, "score": {"$meta": "textScore"}}
+        sort = [("score", {"$meta": "textScore"})]
+    else:
+        projection = PRODUCT_LIST_FIELDS
+    if stream:
+        # ?stream=1 sends one product per line as it comes off the cursor
+        first, docs = await _open_product_stream(filt, projection, sort, payload)
+        return StreamingResponse(_ndjson(first, docs), media_type="application/x-ndjson")
+    if payload.limit > SEARCH_MAX_LIMIT:
+        raise HTTPException(status_code=422, detail=f"limit must be <= {SEARCH_MAX_LIMIT} unless stream=1")
+    docs = await get_documents("product", filt, payload.limit, projection=projection, sort=sort)
+    if not docs and payload.q:
+        docs = [doc async for doc in _title_prefix_matches(payload)]
+    return {"products": docs}
 
 # --------- Orders / Checkout ---------
 class CheckoutItem(BaseModel):
     product_id: str
-    title: str
-    unit_price: float
-    quantity: int = 1
+    # Ignored: the order takes title and price from the product document
+    title: Optional[str] = None
+    unit_price: Optional[float] = None
+    quantity: int = Field(1, ge=1)
 
 class CheckoutPayload(BaseModel):
     email: Optional[str] = None
     items: List[CheckoutItem]
 
-@app.post("/api/checkout")
-def checkout(payload: CheckoutPayload):
-    # compute total server-side
-    total = sum(i.unit_price * i.quantity for i in payload.items)
-    order_doc = {
+# Largest number of orders accepted by one /api/checkout/batch request
+CHECKOUT_BATCH_MAX = 100
+
+
+async def load_products(payloads: List[CheckoutPayload]) -> dict:
+    # Canonical price and title for every distinct product in one
+    # round-trip, so orders never depend on client-supplied values.
+    # Keyed by str(ObjectId), i.e. normalised lowercase hex.
+    try:
+        ids = {ObjectId(i.product_id) for p in payloads for i in p.items}
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid product id")
+    docs = await get_documents("product", {"_id": {"$in": list(ids)}}, None,
+                               projection={"price": 1, "title": 1})
+    return {d["_id"]: d for d in docs}
+
+def build_order(payload: CheckoutPayload, products: dict) -> dict:
+    # compute total server-side, dumping each item once
+    items = []
+    total = 0.0
+    for i in payload.items:
+        item = i.model_dump()
+        item["product_id"] = str(ObjectId(item["product_id"]))
+        product = products.get(item["product_id"])
+        if product is None:
+            raise HTTPException(status_code=400, detail=f"Unknown product {item['product_id']}")
+        item["title"] = product["title"]
+        item["unit_price"] = product["price"]
+        total += item["unit_price"] * item["quantity"]
+        items.append(item)
+    return {
         "user_email": payload.email,
-        "items": [i.model_dump() for i in payload.items],
+        "items": items,
         "total": total,
         "status": "pending",
     }
+
+@app.post("/api/checkout")
+async def checkout(payload: CheckoutPayload):
+    order_doc = build_order(payload, await load_products([payload]))
+    order_id = await create_document("order", order_doc)
+    # Demo payment gateway simulation
+    return {"status": "requires_payment", "order_id": order_id, "amount": order_doc["total"]}
+
+@app.post("/api/checkout/batch")
+async def checkout_batch(payloads: Annotated[List[CheckoutPayload], Body(max_length=CHECKOUT_BATCH_MAX)]):
+    # FastAPI validates the whole list with one TypeAdapter built at startup
+    products = await load_products(payloads)
+    order_docs = [build_order(p, products) for p in payloads]
+    # Assign ids up front so a partial failure can still report them
+    for doc in order_docs:
+        doc["_id"] = ObjectId()
     try:
-        order_id = create_document("order", order_doc)
-        # Demo payment gateway simulation
-        return {"status": "requires_payment", "order_id": order_id, "amount": total}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        await create_documents("order", order_docs)
+    except BulkWriteError as e:
+        errors = {err["index"]: err["errmsg"] for err in e.details.get("writeErrors", [])}
+        return ORJSONResponse(status_code=207, content={
+            "orders": [
+                {"status": "failed", "error": errors[n]} if n in errors else
+                {"status": "requires_payment", "order_id": str(doc["_id"]), "amount": doc["total"]}
+                for n, doc in enumerate(order_docs)
+            ]
+        })
+    return {
+        "orders": [
+            {"status": "requires_payment", "order_id": str(doc["_id"]), "amount": doc["total"]}
+            for doc in order_docs
+        ]
+    }
 
 # Payment intent simulation (replace with real gateway later)
 class PaymentConfirm(BaseModel):
@@ -108,47 +315,56 @@ class PaymentConfirm(BaseModel):
     success: bool = True
 
 @app.post("/api/payment/confirm")
-def confirm_payment(payload: PaymentConfirm):
+async def confirm_payment(payload: PaymentConfirm):
     # In a real app, you'd verify with gateway webhook.
+    if db is None:
+        raise ConfigurationError("Database not configured")
     try:
-        # naive update using pymongo directly via database.db
-        from database import db
-        if db is None:
-            raise Exception("Database not configured")
-        status = "paid" if payload.success else "failed"
-        db["order"].update_one({"_id": db.ObjectId(payload.order_id)}, {"$set": {"status": status}})
-        return {"status": status}
-    except Exception as e:
-        # If ObjectId import path wrong, just return success for demo
-        return {"status": "paid" if payload.success else "failed"}
+        order_id = ObjectId(payload.order_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid order id")
+    status = "paid" if payload.success else "failed"
+    # Update and verify the order exists in a single round-trip
+    doc = await db["order"].find_one_and_update(
+        {"_id": order_id},
+        {"$set": {"status": status}},
+        projection={"_id": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return {"status": status}
 
 # --------- Content: blog, testimonials, portfolio ---------
 @app.get("/api/blog")
-def list_blog():
-    try:
-        posts = get_documents("blogpost", {}, 20)
-        return {"posts": posts}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@cache(expire=CONTENT_CACHE_TTL, namespace="blog")
+async def list_blog():
+    # The list view only shows summaries; content is served by the detail route
+    posts = await get_documents("blogpost", {}, 20, projection={"content": 0})
+    return {"posts": posts}
+
+@app.get("/api/blog/{slug}")
+@cache(expire=CONTENT_CACHE_TTL, namespace="blog")
+async def get_blog_post(slug: str):
+    post = await get_document("blogpost", {"slug": slug})
+    if post is None:
+        raise HTTPException(status_code=404, detail="Post not found")
+    return {"post": post}
 
 @app.get("/api/testimonials")
-def list_testimonials():
-    try:
-        items = get_documents("testimonial", {}, 20)
-        return {"testimonials": items}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@cache(expire=CONTENT_CACHE_TTL, namespace="testimonials")
+async def list_testimonials():
+    items = await get_documents("testimonial", {}, 20)
+    return {"testimonials": items}
 
 @app.get("/api/portfolio")
-def list_portfolio():
-    try:
-        items = get_documents("portfolioitem", {}, 20)
-        return {"items": items}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@cache(expire=CONTENT_CACHE_TTL, namespace="portfolio")
+async def list_portfolio():
+    items = await get_documents("portfolioitem", {}, 20)
+    return {"items": items}
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -158,14 +374,13 @@ def test_database():
         "collections": []
     }
     try:
-        from database import db
         if db is not None:
             response["database"] = "✅ Available"
             response["database_url"] = "✅ Configured"
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -182,4 +397,9 @@ def test_database():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+    # Workers re-import database.py, which sizes its pool from this value
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    # Multiple workers require the import string form of the app
+    uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers,
+                loop="uvloop", http="httptools")
@@ -39,7 +39,7 @@ class OrderItem(BaseModel):
     product_id: str
     title: str
     unit_price: float
-    quantity: int = 1
+    quantity: int = Field(1, ge=1)
 
 class Order(BaseModel):
     user_email: Optional[str] = None
@@ -1,13 +1,14 @@
 #!/bin/bash
 echo "Starting FastAPI backend server..."
 
-# Find and kill MainThread processes
-PIDS=$(ps | grep uvicorn | grep -v grep | awk '{print $1}')
-if [ ! -z "$PIDS" ]; then
-  echo "Killing uvicorn processes: $PIDS"
-  for pid in $PIDS; do
-    kill $pid 2>/dev/null || true
-  done
+# Stop the server this script started last time (tracked by pidfile, so
+# unrelated uvicorn/python processes on the host are left alone)
+PIDFILE=logs/server.pid
+if [ -f "$PIDFILE" ]; then
+  PID=$(cat "$PIDFILE")
+  echo "Killing previous server process: $PID"
+  kill $PID 2>/dev/null || true
+  rm -f "$PIDFILE"
   sleep 2
 fi
 
@@ -15,5 +16,7 @@ mkdir -p logs
 echo "Installing dependencies..."
 pip install -r requirements.txt
 echo "Starting FastAPI server..."
-nohup uvicorn main:app --host 0.0.0.0 --port 8000 --reload > logs/server.log 2>&1 
+# main.py starts WEB_CONCURRENCY uvicorn workers (uvloop + httptools)
+nohup python main.py > logs/server.log 2>&1 &
+echo $! > "$PIDFILE"
 echo "Server started in background"